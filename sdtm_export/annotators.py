@@ -1,4 +1,5 @@
 from pandas import DataFrame
+import numpy as np
 
 from .sdtm_exporter import InvalidConfigurationError, SDTMExporterBase
 
@@ -38,12 +39,44 @@ class SequenceAnnotator(Annotator):
 
     def __init__(self, group_by=None):
         self.group_by = group_by
+        self._oid_cache = {}
 
     def annotate(self, sdtm_exporter: SDTMExporterBase, data: DataFrame):
         group_by = self.group_by or sdtm_exporter.sort_by
-        if getattr(sdtm_exporter.variables, self.header, None):
-            data[sdtm_exporter.variables[self.header].oid] = (
-                data.groupby(group_by).cumcount() + 1
-            ).astype(str)
-        else:
-            raise InvalidConfigurationError("a header must be set on the annotator")
+        data[self._get_oid(sdtm_exporter)] = self._sequence(
+            data, group_by, sdtm_exporter.sort_by
+        ).astype(str)
+
+    def _get_oid(self, sdtm_exporter: SDTMExporterBase):
+        # The header's variable is looked up once per set of variables
+        variables = sdtm_exporter.variables
+        oid = self._oid_cache.get(variables)
+        if oid is None:
+            variable = getattr(variables, self.header, None)
+            if not variable:
+                raise InvalidConfigurationError("a header must be set on the annotator")
+            oid = self._oid_cache[variables] = variable.oid
+        return oid
+
+    @staticmethod
+    def _sequence(data: DataFrame, group_by, sort_by):
+        group_by = group_by if isinstance(group_by, list) else [group_by]
+        sort_by = sort_by if isinstance(sort_by, list) else [sort_by]
+
+        # The data has already been sorted, so if we are grouping by a prefix of
+        # the sort keys each group is a contiguous run of rows and the sequence
+        # number is just the distance from the start of the run
+        if group_by != sort_by[: len(group_by)]:
+            # Group keys don't need sorting to count within each group, and
+            # rows with missing keys are numbered rather than left as NaN
+            grouped = data.groupby(group_by, sort=False, dropna=False)
+            return grouped.cumcount().to_numpy() + 1
+
+        # Missing keys are counted as equal, as they are grouped together above
+        keys = data[group_by]
+        previous_keys = keys.shift()
+        same = (previous_keys == keys) | (previous_keys.isna() & keys.isna())
+        boundary = ~same.all(axis=1).to_numpy()
+        positions = np.arange(len(data))
+        run_starts = np.maximum.accumulate(np.where(boundary, positions, 0))
+        return positions - run_starts + 1
@@ -1,3 +1,6 @@
+import os
+
+import numpy as np
 import pandas as pd
 
 # TODO - grab this from CDISC library API instead
@@ -6,6 +9,31 @@ import pandas as pd
 # The SDTMIG_v3.4.xlsx sheet can be found in the CDISC Library
 # https://www.cdisc.org/members-only/cdisc-library-archives
 
+SDTMIG_PATH = "SDTMIG_v3.4.xlsx"
+SDTMIG_CACHE_PATH = "SDTMIG_v3.4.pkl"
+
+
+def read_variables_sheet():
+    """
+    Parsing the spreadsheet is slow, so the parsed "Variables" sheet is cached
+    alongside it and reused until the spreadsheet is modified.
+
+    The cache is a pickle, which can run arbitrary code when it's loaded, so
+    it's trusted as having been written by this function. Don't use a cache
+    file from anywhere else.
+    """
+    sheet_modified = os.path.getmtime(SDTMIG_PATH)
+    if (
+        os.path.exists(SDTMIG_CACHE_PATH)
+        and os.path.getmtime(SDTMIG_CACHE_PATH) >= sheet_modified
+    ):
+        return pd.read_pickle(SDTMIG_CACHE_PATH)
+
+    df = pd.read_excel(SDTMIG_PATH, sheet_name="Variables")
+    df.to_pickle(SDTMIG_CACHE_PATH)
+    return df
+
+
 if __name__ == "__main__":
     """
     This script grabs metadata from the SDTMIG_v3.4.xlsx sheet (assuming it is co-located)
@@ -30,18 +58,26 @@ if __name__ == "__main__":
     domain = "AE"  # Update to pull different domain
     vars = ["variable_name", "variable_label", "type"]
 
-    df = pd.read_excel("SDTMIG_v3.4.xlsx", sheet_name="Variables")
+    df = read_variables_sheet()
     df.columns = df.columns.str.lower().str.replace(" ", "_")
     vars = df[df["dataset_name"] == domain][vars]
 
-    vars["length"] = 200  # Implementation guides max variable length
-    vars.loc[vars["type"] == "Num", "length"] = 8
-    vars.loc[vars["variable_name"].str.endswith("CD"), "length"] = 8
-    vars.loc[vars["variable_name"].str.endswith("TEST"), "length"] = 40
-    vars.loc[vars["variable_name"].str.endswith("PARM"), "length"] = 40
-    vars.loc[vars["variable_name"].str.endswith("DECOD"), "length"] = 40
-    vars.loc[vars["variable_name"].str.endswith("SUBJID"), "length"] = 24
-    vars.loc[vars["variable_name"].str.endswith("STUDYID"), "length"] = 24
+    # Lengths by variable name suffix, taking precedence over the type
+    suffix_lengths = {
+        "CD": 8,
+        "TEST": 40,
+        "PARM": 40,
+        "DECOD": 40,
+        "SUBJID": 24,
+        "STUDYID": 24,
+    }
+    names = vars["variable_name"].to_numpy(dtype=str)
+    vars["length"] = np.select(
+        [np.char.endswith(names, suffix) for suffix in suffix_lengths],
+        list(suffix_lengths.values()),
+        # Implementation guides max variable length
+        default=np.where(vars["type"].to_numpy() == "Num", 8, 200),
+    )
 
     for i, r in vars.iterrows():
         row_string = f"""("{r.variable_name}",\
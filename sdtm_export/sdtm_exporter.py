@@ -1,12 +1,175 @@
-from collections import defaultdict
+from collections import OrderedDict
 from collections.abc import Iterable
-from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from itertools import chain, islice
+from operator import itemgetter, methodcaller
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 import csv
+import json
 import re
 
 from django.db import models
 
 from pandas import DataFrame
+import numpy as np
+import pandas as pd
+
+from .utils import format_series
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_TO_SNAKE_CASE = re.compile(r"(?<!^)(?=[A-Z])")
+_CSV_SPECIAL_CHARACTERS = (",", '"', "\r", "\n")
+
+
+def _get_ascending(sort_order):
+    """
+    Converts a `sort_order` into the `ascending` argument of `sort_values`
+    """
+    if isinstance(sort_order, list):
+        return [o != "desc" for o in sort_order]
+    return sort_order != "desc"
+
+
+def _constant_column(value, length):
+    """
+    Returns a column of `length` rows which all hold `value`, stored as a
+    categorical with a single category where the value allows it (categories
+    can't be missing values or unhashable)
+    """
+    try:
+        if not pd.isna(value):
+            return pd.Categorical.from_codes(
+                np.zeros(length, dtype=np.int8), categories=[value]
+            )
+    except (TypeError, ValueError):
+        pass
+    column = np.empty(length, dtype=object)
+    column.fill(value)
+    return column
+
+
+def _blank_missing_value(value):
+    """
+    Returns "" for a missing value (None, NaN, NaT or NA), the same as
+    `_blank_missing_values` does for a whole column, otherwise the value
+    """
+    if type(value) is str:
+        return value
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    return value
+
+
+def _tuple_getter(keys):
+    """
+    Returns a function which gets the values of `keys` from a dict as a tuple,
+    like `itemgetter` but also for a single key
+    """
+    if len(keys) > 1:
+        return itemgetter(*keys)
+    return lambda data: tuple(data[key] for key in keys)
+
+
+def _is_constant_column(column: pd.Series) -> bool:
+    """
+    Returns whether a column was made by `_constant_column` (or is otherwise a
+    categorical holding a single value on every row)
+    """
+    return (
+        isinstance(column.dtype, pd.CategoricalDtype)
+        and len(column.cat.categories) == 1
+        and not column.hasnans
+    )
+
+
+def _blank_missing_values(data: DataFrame):
+    """
+    Replaces missing values (None, NaN, NaT) with "" in place, as `to_csv`
+    would when writing them. Dataset-JSON exports are blanked the same way
+    """
+    for column in data.columns:
+        if data[column].hasnans:
+            data[column] = data[column].astype(object).where(data[column].notna(), "")
+
+
+def _is_unquoted_csv_text(values: np.ndarray) -> bool:
+    """
+    Returns whether every value is a string which `csv.writer` would write
+    as it is, i.e. without quoting it
+    """
+    if not set(map(type, values)) <= {str}:
+        return False
+    text = "".join(values)
+    return not any(character in text for character in _CSV_SPECIAL_CHARACTERS)
+
+
+def _to_csv_text(value) -> str:
+    """
+    Returns a value as `csv.writer` would write it as part of a row
+    """
+    if value is None:
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    if any(character in text for character in _CSV_SPECIAL_CHARACTERS):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _get_relative_lookup(lookup, prefix):
+    """
+    Returns a prefetch lookup (a string or a `Prefetch`) which starts from the
+    objects fetched by the lookup `prefix`, e.g. "participants__inputs"
+    becomes "inputs" for "participants"
+    """
+    start = len(prefix) + len("__")
+    if isinstance(lookup, models.Prefetch):
+        return models.Prefetch(
+            lookup.prefetch_through[start:], queryset=lookup.queryset
+        )
+    return lookup[start:]
+
+
+def _iter_prefetched(nodes, lookup):
+    """
+    Yields each object reached from `nodes` along a prefetch lookup which has
+    the lookup's next relation prefetched, along with the relation's name.
+    The relation's objects are only walked once the caller resumes, so they
+    are skipped if the caller drops the relation in the meantime.
+    """
+    objects = nodes
+    for name in getattr(lookup, "prefetch_to", lookup).split("__"):
+        children = []
+        for obj in objects:
+            cache = getattr(obj, "_prefetched_objects_cache", {})
+            if name in cache:
+                yield obj, name
+                children.extend(cache.get(name, ()))
+        objects = children
+
+
+def _get_relation(model, accessor_name):
+    """
+    Returns the relation on `model` which is accessed through the attribute
+    `accessor_name`, or None if there isn't one. Reverse relations are matched
+    on their accessor (e.g. "participant_set") rather than their query name.
+    """
+    if not isinstance(accessor_name, str):
+        return None
+
+    for field in model._meta.get_fields():
+        if not field.is_relation:
+            continue
+        if field.auto_created and not field.concrete:
+            name = field.get_accessor_name()
+        else:
+            name = field.name
+        if name == accessor_name:
+            return field
+    return None
 
 
 class MissingVisitorError(Exception):
@@ -87,6 +250,46 @@ class SDTMExporterBase:
     `sort_order`:
         'asc' or 'desc' (or a list of 'asc' or 'desc'). Default: 'asc'
 
+    `sort_by_orm_fields`:
+        Optional. A dictionary mapping `sort_by` variable oids to the node model
+        and field they are exported from, e.g.
+            {Variables.SUBJECT_ID.oid: (Participant, "subject_id")}
+
+        If every `sort_by` variable is mapped, and they sort each level of the
+        tree in turn from the top downwards, the nodes are fetched already
+        sorted with `order_by` and the exported data isn't sorted again. Only
+        map fields which the database orders the same way as their exported
+        values. Rows below two nodes with equal sort values aren't interleaved.
+        Children already prefetched on the exported node are kept as they
+        are, and sorted after the export instead.
+
+    `select_related_fields`:
+        Optional. A dictionary mapping node models to the relations to fetch
+        along with them using `select_related`, e.g. {Input: ["unit"]}, for
+        relations which are read by the visitors but aren't nodes themselves.
+
+    `format_values`:
+        If true, the values returned by visitors are formatted with
+        `sdtm_export.utils.format_value` rules (None to "", booleans and
+        "Yes"/"No" to "Y"/"N", dates to ISO 8601) one column at a time once
+        all nodes have been visited. Default: False
+
+    `export_cache_size`:
+        The number of exports (one per `subtree_node`) to keep in memory, so
+        that e.g. a CSV and a Dataset-JSON export of the same data only walk
+        the tree once. Cached exports aren't updated when the data changes,
+        see `invalidate_cache`. Default: 0 (no caching)
+
+    `csv_chunk_size`:
+        The number of rows written at a time in a CSV export, which bounds how
+        many rows are held in memory when they are written as they are
+        exported. Default: 10000
+
+    `prefetch_batch_size`:
+        When a CSV export's rows are written as they are exported, the number
+        of children of the export's start node (e.g. participants of a study)
+        whose subtrees are prefetched at a time. Default: 100
+
     Exporting:
     -----------
 
@@ -106,6 +309,11 @@ class SDTMExporterBase:
                     exporter.export(participant)
                 and only this participant's rows would be exported
 
+                Exporting a subtree visits every ancestor of the node. To
+                avoid a query per ancestor, fetch the node with
+                `get_subtree_queryset`, e.g.
+                    exporter.get_subtree_queryset(LabResult).get(pk=pk)
+
     `export_to_csv`:
         Parameters:
             - `file`: file object to write to
@@ -173,6 +381,12 @@ class SDTMExporterBase:
             "itemGroupData": { ... }
         }
 
+    `export_to_json_string`:
+        Returns the output of `export_to_json` serialized as a JSON string.
+        orjson is used if it is installed (the `orjson` extra), which is much
+        faster for large exports, otherwise the standard library's json
+        module is. Both give the same output.
+
     """
 
     nodes = []
@@ -186,7 +400,13 @@ class SDTMExporterBase:
 
     sort_by = None
     sort_order = None
+    sort_by_orm_fields = {}
+    select_related_fields = {}
     annotators = None
+    format_values = False
+    export_cache_size = 0
+    csv_chunk_size = 10000
+    prefetch_batch_size = 100
 
     def get_study_id(self):
         study = self.get_ancestor("Study")
@@ -198,52 +418,115 @@ class SDTMExporterBase:
         + "make final assessments on the efficacy of the treatment being investigated."
     )
 
+    # Derived from `nodes` once per subclass, see `__init_subclass__`
+    _node_structure = {}
+    _node_classes = {}
+    _visitor_names = {}
+    _variable_oids = ()
+    _variables_meta = ()
+    _json_items = ()
+    _row_getter = staticmethod(_tuple_getter(()))
+    _sort_ascending = True
+
+    # Whether to raise an error when sibling nodes return different data,
+    # rather than leaving the missing fields blank. Skipped under python -O
+    _validate_rows = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._initialize_node_structure(cls)
+        cls._initialize_visitor_names(cls)
+        cls._initialize_variables(cls)
+        cls._sort_ascending = _get_ascending(cls.sort_order)
+
     def __init__(self, root):
         self.root = root
-        self._initialize_node_structure()
+        if "nodes" in self.__dict__:
+            # A subclass may set nodes on the instance before calling this
+            self._initialize_node_structure(self)
+            self._initialize_visitor_names(self)
         self._initialize_node_cache()
-        self._initialize_visitor_names()
+        self._initialize_visitors()
+        self._export_cache = OrderedDict()
 
-    def _initialize_node_structure(self):
+    @staticmethod
+    def _initialize_node_structure(exporter):
+        # `exporter` is the exporter class, or an instance which has its own
+        # `nodes`
         # TODO: Maybe some assertions about order and types?
-        self._node_structure = {
-            node.__name__: {"child": child, "parent": parent}
-            for node, child, parent in self.nodes
+        exporter._node_structure = {
+            node: {"child": child, "parent": parent}
+            for node, child, parent in exporter.nodes
         }
+        exporter._node_classes = {node.__name__: node for node, _, _ in exporter.nodes}
 
     def _initialize_node_cache(self):
-        self._node_cache = {node.__name__: None for node, _, _ in self.nodes}
-        self._node_cache[self.root.__class__.__name__] = self.root
-
-    def _initialize_visitor_names(self):
-        to_snake_case = re.compile(r"(?<!^)(?=[A-Z])")
-        names = [node.__name__ for node, _, _ in self.nodes]
-        self._visitor_names = {
-            name: f"visit_{to_snake_case.sub('_', name).lower()}" for name in names
+        self._node_cache = {node: None for node, _, _ in self.nodes}
+        self._node_cache[type(self.root)] = self.root
+
+    @staticmethod
+    def _initialize_visitor_names(exporter):
+        exporter._visitor_names = {
+            node: f"visit_{_TO_SNAKE_CASE.sub('_', node.__name__).lower()}"
+            for node, _, _ in exporter.nodes
         }
 
-    def _update_node_cache(self, node):
-        self._node_cache[node.__class__.__name__] = node
+    @staticmethod
+    def _initialize_variables(exporter):
+        # `exporter` is the exporter class, or an instance which has its own
+        # `variables`, see `_update_variables`
+        variables = exporter.variables
+        exporter._variable_oids = variables.oids() if variables else ()
+        exporter._variables_meta = variables.metadata() if variables else ()
+        row_getter = _tuple_getter(exporter._variable_oids)
+        if isinstance(exporter, type):
+            # Otherwise the function would be bound to each instance
+            row_getter = staticmethod(row_getter)
+        exporter._row_getter = row_getter
+        exporter._json_items = tuple(
+            {
+                "OID": "IT." + str(oid),
+                "name": name,
+                "label": label,
+                "type": type,
+                "length": length,
+            }
+            for oid, name, label, type, length in exporter._variables_meta
+        )
+
+    def _update_variables(self):
+        # Use the attributes worked out for the class unless variables has
+        # been changed on this instance
+        if "variables" in self.__dict__:
+            self._initialize_variables(self)
+        else:
+            names = ("_variable_oids", "_variables_meta", "_row_getter", "_json_items")
+            for name in names:
+                self.__dict__.pop(name, None)
+
+    def _initialize_visitors(self):
+        # Missing visitors are only reported once a node of that type is visited
+        self._visitors = {
+            node: getattr(self, name, None)
+            for node, name in self._visitor_names.items()
+        }
 
     def get_ancestor(self, node):
         if isinstance(node, str):
-            key = node
-        else:
-            key = node.__name__
-        return self._node_cache[key]
+            node = self._node_classes[node]
+        return self._node_cache[node]
 
     def _visit_node(self, node) -> Dict[str, str]:
-        self._update_node_cache(node)
-        visitor_name = self._visitor_names[node.__class__.__name__]
-        try:
-            accessor = getattr(self, visitor_name)
-        except AttributeError:
-            raise MissingVisitorError(visitor_name)
+        node_class = type(node)
+        self._node_cache[node_class] = node
+        visitor = self._visitors[node_class]
+        if visitor is None:
+            raise MissingVisitorError(self._visitor_names[node_class])
 
-        return accessor(node)
+        return visitor(node)
 
     def _is_node_leaf(self, node) -> bool:
-        return self._node_structure[node.__class__.__name__]["child"] is None
+        return self._node_structure[type(node)]["child"] is None
 
     def _evaluate_attribute(self, attr, node):
         if isinstance(attr, str):
@@ -257,8 +540,147 @@ class SDTMExporterBase:
 
         return value
 
+    def _get_prefetch_path(self, node_class) -> List[Tuple[str, Any]]:
+        """
+        Returns the lookups which prefetch all the nodes below `node_class`
+        with one query per level, each along with the model it fetches, e.g.
+        [("participants", Participant), ("participants__inputs", Input)].
+
+        The child accessors are followed for as long as they name a relation
+        on a model. Nodes reached any other way are fetched as they are
+        visited.
+        """
+        prefetch_path = []
+        path = None
+        while len(prefetch_path) < len(self.nodes):
+            structure = self._node_structure.get(node_class)
+            if structure is None or not issubclass(node_class, models.Model):
+                break
+
+            child_attr = structure["child"]
+            relation = _get_relation(node_class, child_attr)
+            if relation is None or relation.related_model is None:
+                break
+
+            path = f"{path}__{child_attr}" if path else child_attr
+            node_class = relation.related_model
+            prefetch_path.append((path, node_class))
+
+        return prefetch_path
+
+    def _get_prefetch_lookups(self, node) -> List[Union[str, models.Prefetch]]:
+        ordering = self._get_orm_ordering(node) or {}
+        lookups = []
+        for lookup, model in self._get_prefetch_path(type(node)):
+            select_related = self.select_related_fields.get(model)
+            if lookup not in ordering and not select_related:
+                lookups.append(lookup)
+                continue
+
+            queryset = model._default_manager.all()
+            if lookup in ordering:
+                queryset = queryset.order_by(*ordering[lookup])
+            if select_related:
+                queryset = queryset.select_related(*select_related)
+            lookups.append(models.Prefetch(lookup, queryset=queryset))
+        return lookups
+
+    def _get_orm_ordering(self, node) -> Optional[Dict[str, List[str]]]:
+        """
+        Returns the `order_by` fields for each prefetch lookup below `node`
+        which make the walk reach rows already in `sort_by` order, or None if
+        the sort can't be handed to the ORM.
+
+        This is only possible when every `sort_by` variable is mapped in
+        `sort_by_orm_fields`, and the variables sort each level of the tree in
+        turn from the top downwards. Variables taken from `node` or its
+        ancestors have a single value for the whole export so are skipped.
+        Children which were already prefetched on `node` are exported as they
+        were fetched, so aren't necessarily in order.
+        """
+        if not self.sort_by or not self.sort_by_orm_fields:
+            return None
+
+        sort_by = self.sort_by if isinstance(self.sort_by, list) else [self.sort_by]
+        ascending = self._get_sort_ascending()
+        if not isinstance(ascending, list):
+            ascending = [ascending] * len(sort_by)
+        if len(ascending) != len(sort_by):
+            return None
+
+        node_class = type(node)
+        node_classes = list(self._node_structure)
+        if node_class not in node_classes:
+            return None
+        prefetch_path = self._get_prefetch_path(node_class)
+        prefetched = getattr(node, "_prefetched_objects_cache", {})
+        if prefetch_path and prefetch_path[0][0] in prefetched:
+            return None
+        depths = {model: depth for depth, (_, model) in enumerate(prefetch_path)}
+
+        ordering = {}
+        current_depth = -1
+        for oid, asc in zip(sort_by, ascending):
+            if oid not in self.sort_by_orm_fields:
+                return None
+            model, field = self.sort_by_orm_fields[oid]
+
+            if model not in depths:
+                if model in node_classes and node_classes.index(
+                    model
+                ) <= node_classes.index(node_class):
+                    continue
+                return None
+            # Each level has to be sorted before the one below it
+            if depths[model] not in (current_depth, current_depth + 1):
+                return None
+
+            current_depth = depths[model]
+            lookup = prefetch_path[current_depth][0]
+            ordering.setdefault(lookup, []).append(field if asc else f"-{field}")
+
+        # Fall back on the primary key for a deterministic order between ties
+        return {lookup: [*fields, "pk"] for lookup, fields in ordering.items()}
+
+    @contextmanager
+    def _prefetch_children(self, node):
+        """
+        Prefetches the subtree below `node` for the duration of an export, see
+        `_prefetch`
+        """
+        lookups = []
+        if isinstance(node, models.Model):
+            lookups = self._get_prefetch_lookups(node)
+        with self._prefetch([node], lookups):
+            yield
+
+    @contextmanager
+    def _prefetch(self, nodes, lookups):
+        """
+        Prefetches `lookups` on `nodes` for the duration of an export. The
+        objects prefetched for the export, at any level of the lookups, are
+        dropped afterwards so that a later export doesn't read stale data.
+        Objects which were already prefetched are reused and left in place.
+        """
+        existing = set()
+        if nodes and lookups:
+            existing = {
+                (id(obj), name)
+                for lookup in lookups
+                for obj, name in _iter_prefetched(nodes, lookup)
+            }
+            models.prefetch_related_objects(nodes, *lookups)
+
+        try:
+            yield
+        finally:
+            for lookup in lookups:
+                for obj, name in _iter_prefetched(nodes, lookup):
+                    if (id(obj), name) not in existing:
+                        obj._prefetched_objects_cache.pop(name)
+
     def _get_children(self, node) -> List:
-        child_attr = self._node_structure[node.__class__.__name__]["child"]
+        child_attr = self._node_structure[type(node)]["child"]
         if child_attr is None:
             return []
         value = self._evaluate_attribute(child_attr, node)
@@ -269,7 +691,7 @@ class SDTMExporterBase:
         return [value]
 
     def _get_parent(self, node) -> Optional[Any]:
-        parent_attr = self._node_structure[node.__class__.__name__]["parent"]
+        parent_attr = self._node_structure[type(node)]["parent"]
         if parent_attr is None:
             return None
         value = self._evaluate_attribute(parent_attr, node)
@@ -277,98 +699,232 @@ class SDTMExporterBase:
             raise InvalidAttributeError()
         return value
 
-    def export(self, subtree_node=None) -> DataFrame:
-        # Validate configuration
+    def _get_ancestor_lookup(self, node_class) -> Optional[str]:
+        """
+        Returns the select_related lookup which fetches every ancestor of
+        `node_class` along with it, e.g. "participant__study".
+
+        The parent accessors are followed for as long as they name a foreign
+        key on a model.
+        """
+        path = []
+        while len(path) < len(self.nodes):
+            structure = self._node_structure.get(node_class)
+            if structure is None or not issubclass(node_class, models.Model):
+                break
+
+            parent_attr = structure["parent"]
+            relation = _get_relation(node_class, parent_attr)
+            if relation is None or not relation.concrete:
+                break
+
+            path.append(parent_attr)
+            node_class = relation.related_model
+
+        return "__".join(path) or None
+
+    def get_subtree_queryset(self, node_class) -> models.QuerySet:
+        """
+        Returns a queryset of `node_class` which fetches each node's ancestors
+        in the same query, for looking up a node to pass as `subtree_node`.
+        """
+        queryset = node_class._default_manager.all()
+        lookup = self._get_ancestor_lookup(node_class)
+        if lookup:
+            queryset = queryset.select_related(lookup)
+        return queryset
+
+    def _validate_configuration(self):
         if not self.domain or not self.domain_variable:
             raise InvalidConfigurationError("domain and domain_variable must be set")
 
-        if subtree_node:
-            data = self._export_subtree(subtree_node)
+    def export(self, subtree_node=None) -> DataFrame:
+        self._validate_configuration()
+        self._update_variables()
+
+        key = self._get_cache_key(subtree_node)
+        data = self._export_cache.get(key) if key is not None else None
+        if data is not None:
+            self._export_cache.move_to_end(key)
         else:
-            data = self._export(self.root)
+            if subtree_node:
+                data = self._export_subtree(subtree_node)
+            else:
+                data = self._export(self.root)
+            self._cache_export(key, data)
 
-        data = DataFrame(data)
-        return self._post_process(data)
+        # Post processing only ever replaces columns or the frame itself, so a
+        # shallow copy is enough to leave the cached export untouched
+        return self._post_process(
+            data.copy(deep=False), self._is_sorted_by_orm(subtree_node)
+        )
 
-    def _export(self, node, extra_data=None) -> Dict[str, List[str]]:
+    def invalidate_cache(self):
         """
-        Parameters: A node (i.e. study, survey, response, etc.)
-        Returns:
-          A dictionary representation of an exported spreadsheet
-          for this node: {header: [row items]}
-
-        If the node has no children, this method simply visits the
-        node and returns the resulting data as a single row. If the
-        node does have children, this method collects all the exported
-        data for the children and then adds the results of visiting the
-        node as a new set of columns to all the rows.
+        Forgets all cached exports, e.g. after the exported data has changed
         """
-        node_data = self._visit_node(node)
-        if extra_data:
-            node_data = {**extra_data, **node_data}
-        if self._is_node_leaf(node):
-            return {k: [v] for k, v in node_data.items()}
+        self._export_cache.clear()
+
+    def _get_cache_key(self, subtree_node=None):
+        # The ORM ordering is part of the key since it changes the row order
+        node = subtree_node or self.root
+        ordering = self._get_orm_ordering(node) or {}
+        ordering = tuple((lookup, tuple(fields)) for lookup, fields in ordering.items())
+
+        if not subtree_node:
+            return (type(self.root), None, ordering)
+        pk = getattr(subtree_node, "pk", None)
+        if pk is None:
+            return None
+        return (type(subtree_node), pk, ordering)
 
-        children = self._get_children(node)
-        child_data, row_count = self._export_list(children)
-        if row_count is not None:
-            for k, v in node_data.items():
-                child_data[k] = [v] * row_count
+    def _is_sorted_by_orm(self, subtree_node=None) -> bool:
+        node = subtree_node or self.root
+        return self._get_orm_ordering(node) is not None
 
-        return child_data
+    def _cache_export(self, key, data: DataFrame):
+        if key is None or self.export_cache_size <= 0:
+            return
+        self._export_cache[key] = data
+        while len(self._export_cache) > self.export_cache_size:
+            self._export_cache.popitem(last=False)
 
-    def _export_list(self, nodes: List) -> Dict[str, List[str]]:
+    def _export(self, node, extra_data=None) -> DataFrame:
         """
-        Parameters: A list of nodes (i.e. surveys, responses, etc.)
-        Returns: A tuple with...
-          - A defaultdict(list) with all joined exported data from the nodes
-          - The number of rows that each value in the dict has
+        Parameters: A node (i.e. study, survey, response, etc.)
+        Returns:
+          A DataFrame of the exported spreadsheet for this node, with a
+          column for each header
         Throws:
           A ValueError if two dict keys (headers) have a different number
-          of rows beneath them
-
-        Note - This method does not handle the case where two siblings return
-        different data, e.g. one question on a survey returns VSLOC (measurement
-        location) and another doesn't. It will need to extended so that None is
-        populated in missing fields for cases like this
+          of rows beneath them, when `_validate_rows` is set
+
+        Once the tree has been walked the number of rows is known, so each
+        column is filled straight into an array of its final size. Values from
+        the node and its ancestors are the same on every row, so their columns
+        are stored as categoricals (see `_constant_column`). Columns are
+        keyed by the exported keys, which are usually variables' oids. Those
+        which aren't are kept so they can still be sorted on. Variables which
+        weren't exported are added as blanks by `_finalize_columns`.
+
+        The other columns are filled into the rows of a single 2D object
+        array, so the DataFrame holds them in one block which it can sort and
+        convert back to an array without consolidating them first.
+
+        Note - When two siblings return different data, e.g. one question on a
+        survey returns VSLOC (measurement location) and another doesn't, the
+        missing fields are populated with blanks
         """
-        data = defaultdict(list)
-
-        for node in nodes:
-            node_data = self._export(node)
-            for k, v in node_data.items():
-                data[k].extend(v)
+        with self._prefetch_children(node):
+            shared_data = self._visit_start_node(node, extra_data)
+            rows = list(self._walk(node, shared_data))
+
+        exported = dict.fromkeys(chain.from_iterable(rows))
+        complete = set(map(len, rows)) <= {len(exported)}
+        if __debug__ and self._validate_rows and not complete:
+            raise ValueError("Sibling nodes have differing row counts")
+
+        # Exported keys which the domain or a constant replace are still
+        # collected, since the export is cached and those can change before
+        # the next call. `_finalize_columns` drops them
+        values = np.empty((len(exported), len(rows)), dtype=object)
+        object_headers = []
+        shared_columns = {}
+        for header in exported:
+            column = values[len(object_headers)]
+            if header in shared_data:
+                shared_column = _constant_column(shared_data[header], len(rows))
+                if isinstance(shared_column, pd.Categorical):
+                    shared_columns[header] = shared_column
+                    continue
+                column[:] = shared_column
+            else:
+                # Only rows which all have every header can skip the default
+                if complete:
+                    getter = itemgetter(header)
+                else:
+                    getter = methodcaller("get", header, "")
+                column[:] = np.fromiter(
+                    map(getter, rows), dtype=object, count=len(rows)
+                )
+            object_headers.append(header)
+
+        data = DataFrame(
+            values[: len(object_headers)].T, columns=object_headers, copy=False
+        )
+        if shared_columns:
+            shared_data = DataFrame(shared_columns, index=data.index)
+            data = pd.concat([data, shared_data], axis=1, copy=False)
+        return data
+
+    def _visit_start_node(self, node, extra_data=None) -> Dict[str, Any]:
+        """
+        Returns the data from visiting the node an export starts from, which is
+        shared by every row below it. The node's data takes precedence over
+        `extra_data` from its ancestors.
+        """
+        node_data = self._visit_node(node)
+        if extra_data:
+            node_data = {**extra_data, **node_data}
+        return node_data
 
-        row_count = None
-        for v in data.values():
-            if row_count is None:
-                row_count = len(v)
-            elif row_count != len(v):
-                raise ValueError("Sibling nodes have differing row counts")
+    def _walk(self, node, node_data) -> Iterator[Dict[str, Any]]:
+        """
+        The tree below the node is walked depth first using an explicit stack
+        rather than recursion. Each stack entry holds a node which is yet to be
+        visited along with the data collected from its ancestors, and a row is
+        yielded every time a leaf is reached. Data from an ancestor takes
+        precedence over data from its descendants.
+
+        `node_data` is the data from visiting the node itself, see
+        `_visit_start_node`.
+        """
+        stack = []
+        while True:
+            if self._is_node_leaf(node):
+                yield node_data
+            else:
+                # Children are pushed in reverse so that they are popped, and
+                # so visited, in order. Visiting them only once popped keeps
+                # the node cache pointing at the ancestors of the current node
+                children = list(self._get_children(node))
+                stack.extend((child, node_data) for child in reversed(children))
 
-        return data, row_count
+            if not stack:
+                break
+            node, parent_data = stack.pop()
+            node_data = {**self._visit_node(node), **parent_data}
 
     def _export_subtree(self, node):
         """
         Parameters: A node (i.e. study, survey, response, etc.)
         Returns:
-          A dictionary of an exportable data for the subtree represented
+          A DataFrame of exportable data for the subtree represented
           by this node and all of it's children. E.g. if a single lab
-          result is passed, the dictionary will contain only data
+          result is passed, the DataFrame will contain only data
           related to that one lab result
         """
+        return self._export(node, self._get_subtree_parent_data(node))
+
+    def _get_subtree_parent_data(self, node) -> Dict[str, Any]:
+        """
+        Parameters: A node (i.e. study, survey, response, etc.)
+        Returns:
+          The data from visiting every ancestor of the node, which is shared
+          by all the rows of the node's subtree
+        """
         # In order to ensure that attributes on the visitor are properly
         # set, we still need to visit nodes in the order of their depth.
 
         # Start by building data from the root to the current exported node
         path_to_root = []
-        cur = self._get_parent(node)
+        cur = self._get_subtree_parent(node)
         if cur is None:
             raise ValueError("Cannot export subtree for a root node")
 
         while cur:
             path_to_root.append(cur)
-            cur = self._get_parent(cur)
+            cur = self._get_subtree_parent(cur)
 
         # Confirm that the subtree node matches this exporter's root
         if self.root != path_to_root[-1]:
@@ -379,37 +935,157 @@ class SDTMExporterBase:
         for n in reversed(path_to_root):
             parent_data = {**self._visit_node(n), **parent_data}
 
-        return self._export(node, parent_data)
+        return parent_data
+
+    def _get_subtree_parent(self, node) -> Optional[Any]:
+        """
+        Returns the parent of a node in a subtree being exported. A foreign key
+        to a model of the root's type is checked against the root's id, so
+        the root is reused rather than fetched again, and a node from another
+        root is rejected without fetching its root.
+        """
+        node_class = type(node)
+        if not issubclass(node_class, models.Model):
+            return self._get_parent(node)
+
+        relation = _get_relation(node_class, self._node_structure[node_class]["parent"])
+        if (
+            relation is not None
+            and relation.concrete
+            and isinstance(self.root, relation.related_model)
+        ):
+            root_id = getattr(self.root, relation.target_field.attname)
+            if getattr(node, relation.attname) != root_id:
+                raise ValueError("Subtree export doesn't match export visitor root")
+            return self.root
+        return self._get_parent(node)
+
+    def _iter_rows(
+        self, subtree_node=None, static_data=None, batch_size=None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the data for each exported row as it is reached, without
+        collecting the rows or doing any of the post processing `export` does.
 
-    def _post_process(self, data: DataFrame):
-        self._add_domain(data)
-        self._add_constants(data)
-        self._add_missing_columns(data)
-        self._sort(data)
+        `static_data` is added to every row, taking precedence over the data
+        from visiting nodes. It's merged into the start node's data once, as
+        data from an ancestor already takes precedence over its descendants'.
+
+        If `batch_size` is given, only the children of the start node are
+        fetched up front and their subtrees are prefetched `batch_size`
+        children at a time, so the whole tree is never held in memory at once.
+        """
+        if subtree_node:
+            node, extra_data = subtree_node, self._get_subtree_parent_data(subtree_node)
+        else:
+            node, extra_data = self.root, None
+
+        lookups = []
+        if batch_size and isinstance(node, models.Model):
+            lookups = self._get_prefetch_lookups(node)
+        if len(lookups) < 2:
+            with self._prefetch_children(node):
+                node_data = self._visit_start_node(node, extra_data)
+                if static_data:
+                    node_data = {**node_data, **static_data}
+                yield from self._walk(node, node_data)
+            return
+
+        top_lookup = getattr(lookups[0], "prefetch_to", lookups[0])
+        child_lookups = [
+            _get_relative_lookup(lookup, top_lookup) for lookup in lookups[1:]
+        ]
+        with self._prefetch([node], lookups[:1]):
+            node_data = self._visit_start_node(node, extra_data)
+            if static_data:
+                node_data = {**node_data, **static_data}
+
+            children = list(self._get_children(node))
+            for start in range(0, len(children), batch_size):
+                batch = children[start : start + batch_size]
+                with self._prefetch(batch, child_lookups):
+                    for child in batch:
+                        child_data = {**self._visit_node(child), **node_data}
+                        yield from self._walk(child, child_data)
+
+    def _post_process(self, data: DataFrame, sorted_by_orm=False):
+        self._format_values(data)
+        data = self._finalize_columns(data)
+        if not sorted_by_orm:
+            self._sort(data)
         self._annotate(data)
         # Order columns properly
-        return data[list([v.oid for v in self.variables])]
+        return data.reindex(columns=self._variable_oids, copy=False)
+
+    def _get_sort_ascending(self):
+        # Use the value worked out for the class unless sort_order has been
+        # changed on this instance
+        if "sort_order" in self.__dict__:
+            return _get_ascending(self.sort_order)
+        return self._sort_ascending
 
     def _sort(self, data: DataFrame):
-        if self.sort_by:
-            order = (
-                self.sort_order != "desc"
-                if not isinstance(self.sort_order, list)
-                else [o != "desc" for o in self.sort_order]
-            )
-            data.sort_values(self.sort_by, ascending=order, inplace=True)
+        # A stable sort keeps rows with equal keys in the order they were
+        # exported, so sequence numbers are deterministic. Several keys are
+        # sorted in one call, which factorizes them together; sorting once
+        # per key from the least significant up, or with np.lexsort over
+        # factorized keys, was measured to be no faster
+        if not self.sort_by:
+            return
+
+        sort_by = self.sort_by if isinstance(self.sort_by, list) else [self.sort_by]
+        ascending = self._get_sort_ascending()
+        if not isinstance(ascending, list):
+            ascending = [ascending] * len(sort_by)
+        if len(ascending) == len(sort_by):
+            # Keys with the same value on every row, like the study or the
+            # domain, can't change the order so aren't sorted on
+            keys = [
+                (column, asc)
+                for column, asc in zip(sort_by, ascending)
+                if not _is_constant_column(data[column])
+            ]
+            if not keys:
+                return
+            sort_by, ascending = map(list, zip(*keys))
 
-    def _add_domain(self, data: DataFrame):
-        data[self.domain_variable] = self.domain
+        data.sort_values(sort_by, ascending=ascending, inplace=True, kind="stable")
 
-    def _add_constants(self, data: DataFrame):
-        for key, value in self.constants.items():
-            data[key] = value
+    def _format_values(self, data: DataFrame):
+        if self.format_values:
+            for column in data.columns:
+                data[column] = format_series(data[column])
 
-    def _add_missing_columns(self, data: DataFrame):
-        for variable in self.variables:
-            if variable.oid not in data:
-                data[variable.oid] = ""
+    def _get_static_columns(self) -> Dict[str, Any]:
+        """
+        Returns the columns which have the same value on every row. These take
+        precedence over any values returned by visiting a node.
+        """
+        return {self.domain_variable: self.domain, **self.constants}
+
+    def _finalize_columns(self, data: DataFrame) -> DataFrame:
+        """
+        Adds the domain, the constants and a blank column for each variable
+        which wasn't exported. They are joined on in a single concat rather
+        than being inserted one column at a time, and each is stored as a
+        single category rather than a reference to its value on every row.
+        """
+        columns = self._get_static_columns()
+        for oid in self._variable_oids:
+            if oid not in data and oid not in columns:
+                columns[oid] = ""
+
+        replaced = [column for column in columns if column in data]
+        if replaced:
+            data = data.drop(columns=replaced)
+
+        columns = {
+            column: _constant_column(value, len(data))
+            for column, value in columns.items()
+        }
+        return pd.concat(
+            [data, DataFrame(columns, index=data.index)], axis=1, copy=False
+        )
 
     def _annotate(self, data: DataFrame):
         if self.annotators:
@@ -436,13 +1112,102 @@ class SDTMExporterBase:
         return writer
 
     def _export_to_csv(self, file, subtree_node=None):
-        self._write_csv_disclaimer(file)
-
-        headers = [h.oid for h in self.variables]
+        # Sorting (unless the ORM sorts the rows), annotating and formatting
+        # need all of the rows at once, otherwise the rows are written out as
+        # they are exported
+        if (
+            (self.sort_by and not self._is_sorted_by_orm(subtree_node))
+            or self.annotators
+            or self.format_values
+        ):
+            self._export_to_csv_from_data_frame(file, subtree_node)
+        else:
+            self._stream_to_csv(file, subtree_node)
 
+    def _export_to_csv_from_data_frame(self, file, subtree_node=None):
         data = self.export(subtree_node)
+        _blank_missing_values(data)
+
+        if len(data.columns) == 1:
+            # csv.writer quotes a blank value when it's the only one in a row
+            writer = self._write_csv_disclaimer(file)
+            writer.writerow(self._variable_oids)
+            writer.writerows(data.itertuples(index=False, name=None))
+            return
+
+        # Columns which only hold strings that don't need quoting are written
+        # as they are, and only the other columns are formatted a cell at a
+        # time
+        columns = []
+        for column in data.columns:
+            values = data[column].to_numpy(dtype=object)
+            if not _is_unquoted_csv_text(values):
+                values = list(map(_to_csv_text, values))
+            columns.append(values)
+
+        # The rows are joined together directly and written in chunks, with
+        # the disclaimer and header written along with the first chunk
+        lines = self._get_csv_header_lines()
+        rows = zip(*columns)
+        chunk = list(islice(rows, self.csv_chunk_size))
+        while lines or chunk:
+            lines.extend([",".join(row) + "\r\n" for row in chunk])
+            file.write("".join(lines))
+            lines = []
+            chunk = list(islice(rows, self.csv_chunk_size))
+
+    def _get_csv_header_lines(self) -> List[str]:
+        """
+        Returns the disclaimer (if there is one) and header lines of a CSV
+        export, as `_write_csv_disclaimer` and `csv.writer` would write them
+        """
+        lines = []
+        if self.csv_export_disclaimer_text:
+            lines.append(_to_csv_text(self.csv_export_disclaimer_text) + "\r\n")
+        lines.append(",".join(map(_to_csv_text, self._variable_oids)) + "\r\n")
+        return lines
 
-        data.to_csv(file, header=headers, index=False)
+    def _stream_to_csv(self, file, subtree_node=None):
+        self._validate_configuration()
+        self._update_variables()
+
+        writer = self._write_csv_disclaimer(file)
+
+        writer.writerow(self._variable_oids)
+
+        # Rows are written in chunks so that neither every row is held in
+        # memory at once nor is each one written on its own
+        rows = self._iter_row_values(subtree_node)
+        chunk = list(islice(rows, self.csv_chunk_size))
+        while chunk:
+            writer.writerows(chunk)
+            chunk = list(islice(rows, self.csv_chunk_size))
+
+    def _iter_row_values(self, subtree_node=None) -> Iterator[Tuple[Any, ...]]:
+        """
+        Yields the values of each exported row in the order of `variables`,
+        including the domain and constants, as the row is reached. Missing
+        values are blanked as they are for a DataFrame export.
+        """
+        headers = self._variable_oids
+        static_data = self._get_static_columns()
+
+        validate_rows = __debug__ and self._validate_rows
+        keys = None
+        rows = self._iter_rows(subtree_node, static_data, self.prefetch_batch_size)
+        for row in rows:
+            if validate_rows:
+                if keys is None:
+                    keys = row.keys()
+                elif row.keys() != keys:
+                    raise ValueError("Sibling nodes have differing row counts")
+
+            try:
+                # Rows with every variable are read with a single call
+                values = self._row_getter(row)
+            except KeyError:
+                values = tuple(row.get(header, "") for header in headers)
+            yield tuple(map(_blank_missing_value, values))
 
     def export_to_json(self, subtree_node=None):
         if self.label is None:
@@ -451,9 +1216,7 @@ class SDTMExporterBase:
             )
 
         data = self.export(subtree_node)
-
-        # ensure the columns are in the proper order
-        data = data[[v.oid for v in self.variables]]
+        _blank_missing_values(data)
 
         return {
             "clinicalData": {
@@ -462,25 +1225,27 @@ class SDTMExporterBase:
                 "itemGroupData": {
                     "IG."
                     + self.domain: {
-                        "itemData": data.values.tolist(),
+                        "itemData": data.to_numpy(dtype=object).tolist(),
                         "name": self.domain,
                         "label": self.label,
                         "records": len(data.index),
-                        "items": [
-                            {
-                                "OID": "IT." + str(v.oid),
-                                "name": v._name_,
-                                "label": v.cdisc_label,
-                                "type": v.type,
-                                "length": v.length,
-                            }
-                            for v in self.variables
-                        ],
+                        "items": [dict(item) for item in self._json_items],
                     },
                 },
             }
         }
 
+    def export_to_json_string(self, subtree_node=None) -> str:
+        data = self.export_to_json(subtree_node)
+        # Values the stdlib can't serialize, e.g. Decimals and datetimes, are
+        # written as strings. orjson is made to do the same for datetimes
+        # rather than write them itself, and the stdlib output is made as
+        # compact as orjson's
+        if orjson is not None:
+            option = orjson.OPT_PASSTHROUGH_DATETIME
+            return orjson.dumps(data, default=str, option=option).decode()
+        return json.dumps(data, default=str, ensure_ascii=False, separators=(",", ":"))
+
     def _export_to_csv_single_row_transposed(self, file, subtree_node=None):
         """
         For single row exports we may want to change the CSV format.
@@ -503,4 +1268,7 @@ class SDTMExporterBase:
         # TODO: Support better variable descriptions than just
         # the name
         writer.writerow(["Name", "Value", "Description"])
-        writer.writerows([(h.oid, data[h.oid][0], h.name) for h in self.variables])
+        row = data.iloc[0].to_dict()
+        writer.writerows(
+            [(oid, row[oid], name) for oid, name, *_ in self._variables_meta]
+        )
@@ -1,5 +1,11 @@
 from datetime import date, datetime
 
+from pandas import CategoricalDtype, Series
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_object_dtype
+import numpy as np
+
+_NONE_TYPE = type(None)
+
 
 def get_missing_node(cls, **kwargs):
     node = cls()
@@ -32,3 +38,60 @@ def format_value(value):
         return value.isoformat()
 
     return value
+
+
+def format_series(series: Series) -> Series:
+    """
+    Formats every value in a column the same way as `format_value`, working on
+    the whole column at once rather than on one value at a time
+    """
+    if isinstance(series.dtype, CategoricalDtype):
+        # Each category only needs formatting once, as long as formatting
+        # doesn't turn two categories into the same value
+        categories = format_series(
+            Series(np.asarray(series.cat.categories, dtype=object))
+        )
+        if categories.is_unique and not series.hasnans:
+            return series.cat.rename_categories(categories.to_list())
+        return format_series(series.astype(object))
+
+    if is_bool_dtype(series.dtype):
+        return series.map({True: "Y", False: "N"})
+
+    if is_datetime64_any_dtype(series.dtype):
+        # An object array is built directly, as mapping to strings and filling
+        # the missing values would infer datetimes from the strings again
+        values = series.to_numpy(dtype=object)
+        missing = series.isna().to_numpy()
+        formatted = np.full(len(values), "", dtype=object)
+        formatted[~missing] = [v.isoformat() for v in values[~missing]]
+        return Series(formatted, index=series.index, name=series.name)
+
+    if not is_object_dtype(series.dtype):
+        return series
+
+    values = series.to_numpy()
+    types = np.fromiter(map(type, values), dtype=object, count=len(values))
+    present_types = set(types)
+    formatted = values.copy()
+
+    if _NONE_TYPE in present_types:
+        formatted[types == _NONE_TYPE] = ""
+
+    # Match format_value in only treating actual booleans (rather than
+    # anything equal to True or False, like 1 and 0) as booleans
+    is_yes = values == "Yes"
+    is_no = values == "No"
+    if bool in present_types:
+        is_bool = types == bool
+        is_yes |= is_bool & (values == True)  # noqa: E712
+        is_no |= is_bool & (values == False)  # noqa: E712
+    formatted[is_yes] = "Y"
+    formatted[is_no] = "N"
+
+    date_types = [t for t in present_types if issubclass(t, date)]
+    if date_types:
+        is_date = np.isin(types, date_types)
+        formatted[is_date] = [v.isoformat() for v in values[is_date]]
+
+    return Series(formatted, index=series.index, name=series.name)
@@ -13,3 +13,25 @@ class BaseVariables(Enum):
         obj.length = length
 
         return obj
+
+    @classmethod
+    def metadata(cls):
+        """
+        Returns a tuple of (oid, name, cdisc_label, type, length) for each
+        variable, in order. It's worked out the first time it's needed, as the
+        members don't exist yet when `__init_subclass__` is called.
+        """
+        if "_metadata" not in cls.__dict__:
+            cls._metadata = tuple(
+                (v.oid, v._name_, v.cdisc_label, v.type, v.length) for v in cls
+            )
+        return cls._metadata
+
+    @classmethod
+    def oids(cls):
+        """
+        Returns a tuple of the variables' oids, in order
+        """
+        if "_oids" not in cls.__dict__:
+            cls._oids = tuple(oid for oid, *_ in cls.metadata())
+        return cls._oids
@@ -0,0 +1,50 @@
+from ddf import G
+import pytest
+
+from test_project.test_app.models import (
+    Input,
+    InputType,
+    Participant,
+    Question,
+    Study,
+    Unit,
+)
+from test_project.test_app.tests.example_sdtm_exporter import STUDY_NAME, SUBJECT_ID
+
+
+@pytest.fixture
+def study():
+    return G(Study, name=STUDY_NAME)
+
+
+@pytest.fixture
+def participant(study):
+    return G(Participant, study=study, subject_id=SUBJECT_ID)
+
+
+@pytest.fixture
+def two_inputs(participant):
+    """
+    A string input and a number input with a unit, whose questions and the
+    inputs themselves are each created with a single query
+    """
+    questions = Question.objects.bulk_create(
+        [Question(question="String"), Question(question="Number")]
+    )
+    return Input.objects.bulk_create(
+        [
+            Input(
+                participant=participant,
+                type=InputType.STRING,
+                value="Yes",
+                question=questions[0],
+            ),
+            Input(
+                participant=participant,
+                type=InputType.NUMBER_WITH_UNIT,
+                value="10",
+                unit=G(Unit, unit="kg"),
+                question=questions[1],
+            ),
+        ]
+    )
@@ -25,6 +25,7 @@ class ExampleSDTMExporter(SDTMExporterBase):
     ]
     constants = {Variables.TEST_CONSTANT.oid: "0"}
     variables = Variables
+    select_related_fields = {Input: ["unit"]}
 
     csv_export_disclaimer_text = EXPORT_DISCLAIMER_TEXT
 
@@ -39,10 +40,7 @@ class ExampleSDTMExporter(SDTMExporterBase):
         return {Variables.SUBJECT_ID.oid: participant.subject_id}
 
     def visit_input(self, input):
-        if hasattr(input, "unit") and input.unit:
-            unit = input.unit.unit
-        else:
-            unit = ""
+        unit = input.unit.unit if input.unit_id else ""
         return {
             Variables.VALUE.oid: input.value,
             Variables.UNIT.oid: unit,
@@ -1,3 +1,7 @@
+from datetime import datetime
+
+from django.db.models import Prefetch
+
 from ddf import G
 import pytest
 
@@ -52,19 +56,49 @@ class AnnotatedExampleSDTMExporter(ExampleSDTMExporter):
         return {AnnotatedVariables.SUBJECT_ID.oid: participant.subject_id}
 
     def visit_input(self, input):
-        if hasattr(input, "unit") and input.unit:
-            unit = input.unit.unit
-        else:
-            unit = ""
+        unit = input.unit.unit if input.unit_id else ""
         return {
             AnnotatedVariables.VALUE.oid: input.value,
             AnnotatedVariables.UNIT.oid: unit,
         }
 
 
+class PartialExampleSDTMExporter(ExampleSDTMExporter):
+    def visit_input(self, input):
+        data = {Variables.VALUE.oid: input.value}
+        if input.unit_id:
+            data[Variables.UNIT.oid] = input.unit.unit
+        return data
+
+
+class MissingUnitExampleSDTMExporter(AnnotatedExampleSDTMExporter):
+    def visit_input(self, input):
+        return {
+            AnnotatedVariables.VALUE.oid: input.value,
+            AnnotatedVariables.UNIT.oid: input.unit.unit if input.unit_id else None,
+        }
+
+
+class ValidatedExampleSDTMExporter(PartialExampleSDTMExporter):
+    _validate_rows = True
+
+
+class ParticipantSDTMExporter(ExampleSDTMExporter):
+    def __init__(self, root):
+        # Participants are exported without their inputs
+        self.nodes = [(Study, "participants", None), (Participant, None, "study")]
+        super().__init__(root)
+
+
+class DatedExampleSDTMExporter(ExampleSDTMExporter):
+    def visit_input(self, input):
+        value = datetime(2020, 1, 2, 3, 4, 5) if input.value == "Yes" else None
+        return {Variables.VALUE.oid: value}
+
+
 @pytest.mark.django_db
 class TestSDTMExporter:
-    def test_export(self):
+    def test_export(self, study, two_inputs, django_assert_num_queries):
 
         EXPECTED_DATA = {
             Variables.STUDY_NAME.oid: [STUDY_NAME, STUDY_NAME],
@@ -75,31 +109,30 @@ class TestSDTMExporter:
             Variables.TEST_CONSTANT.oid: ["0", "0"],
         }
 
-        study = G(Study, name=STUDY_NAME)
-        participant = G(Participant, study=study, subject_id=SUBJECT_ID)
-        G(
-            Input,
-            participant=participant,
-            type=InputType.STRING,
-            value="Yes",
-            question=G(Question),
-        )
-        G(
-            Input,
-            participant=participant,
-            type=InputType.NUMBER_WITH_UNIT,
-            value="10",
-            unit=G(Unit, unit="kg"),
-            question=G(Question),
-        )
-
         exporter = ExampleSDTMExporter(study)
-        exported_data = exporter.export().to_dict("list")
+
+        # Participants are fetched with one query, and inputs along with
+        # their units with another
+        with django_assert_num_queries(2):
+            exported_data = exporter.export().to_dict("list")
 
         assert set(exported_data.keys()) == set(EXPECTED_DATA.keys())
         for k, values in exported_data.items():
             assert sorted(values, key=str) == sorted(EXPECTED_DATA[k], key=str)
 
+        # Values shared by every row are stored as categoricals
+        data = exporter.export()
+        assert data[Variables.STUDY_NAME.oid].dtype == "category"
+        assert data[Variables.DOMAIN.oid].dtype == "category"
+
+        # Variables changed on the exporter are used from then on
+        exporter.variables = AnnotatedVariables
+        columns = exporter.export().columns.tolist()
+        assert columns == [variable.oid for variable in AnnotatedVariables]
+        del exporter.variables
+        columns = exporter.export().columns.tolist()
+        assert columns == [variable.oid for variable in Variables]
+
         # Using subtree export on the root should raise an error
         with pytest.raises(ValueError):
             exporter.export(study)
@@ -120,6 +153,131 @@ class TestSDTMExporter:
         with pytest.raises(ValueError):
             exporter.export(input2)
 
+        # The root is compared by id, so only the participant is fetched
+        input2 = Input.objects.get(pk=input2.pk)
+        with django_assert_num_queries(1):
+            with pytest.raises(ValueError):
+                exporter.export(input2)
+
+    def test_export_instance_nodes(self, study, two_inputs):
+        data = ParticipantSDTMExporter(study).export()
+
+        assert data[Variables.SUBJECT_ID.oid].tolist() == [SUBJECT_ID]
+        assert data[Variables.VALUE.oid].tolist() == [""]
+
+    def test_subtree_queryset(self, django_assert_num_queries, study, participant):
+        input = G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+
+        exporter = ExampleSDTMExporter(study)
+        input = exporter.get_subtree_queryset(Input).get(pk=input.pk)
+
+        # The participant and study have already been fetched with the input
+        with django_assert_num_queries(0):
+            data = exporter.export(input)
+
+        assert data[Variables.SUBJECT_ID.oid].tolist() == [SUBJECT_ID]
+
+    def test_cached_export(self, django_assert_num_queries, study, participant):
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+
+        uncached_exporter = ExampleSDTMExporter(study)
+        assert len(uncached_exporter.export()) == 1
+        exporter = ExampleSDTMExporter(study)
+        exporter.export_cache_size = 4
+        assert len(exporter.export()) == 1
+
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="No",
+            question=G(Question),
+        )
+
+        # Exports aren't cached unless the cache is given a size
+        assert len(uncached_exporter.export()) == 2
+
+        # Repeated exports are served from the cache until it is invalidated
+        with django_assert_num_queries(0):
+            assert len(exporter.export()) == 1
+
+        # Changing a constant which replaces an exported variable still takes
+        # effect on a cached export
+        exporter.invalidate_cache()
+        exporter.constants = {Variables.VALUE.oid: "CONST"}
+        assert exporter.export()[Variables.VALUE.oid].tolist() == ["CONST"] * 2
+        exporter.constants = {}
+        with django_assert_num_queries(0):
+            values = exporter.export()[Variables.VALUE.oid].tolist()
+        assert sorted(values) == ["No", "Yes"]
+
+    def test_export_prefetched_root(self, study, participant):
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+
+        study = Study.objects.prefetch_related("participants").get(pk=study.pk)
+        assert len(ExampleSDTMExporter(study).export()) == 1
+
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="No",
+            question=G(Question),
+        )
+
+        # Inputs fetched for the first export aren't left on the participants
+        # the caller prefetched
+        assert len(ExampleSDTMExporter(study).export()) == 2
+
+    def test_export_differing_siblings(self, study, participant):
+        G(
+            Input,
+            participant=participant,
+            type=InputType.NUMBER_WITH_UNIT,
+            value="10",
+            unit=G(Unit, unit="kg"),
+            question=G(Question),
+        )
+        input = G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+
+        # Fields missing from some siblings are left blank
+        exporter = PartialExampleSDTMExporter(study)
+        assert exporter.export()[Variables.UNIT.oid].tolist() == ["kg", ""]
+
+        # Fields which aren't exported at all are stored as a single blank
+        # category
+        unit = exporter.export(input)[Variables.UNIT.oid]
+        assert unit.tolist() == [""]
+        assert unit.dtype == "category"
+
+        exporter = ValidatedExampleSDTMExporter(study)
+        with pytest.raises(ValueError):
+            exporter.export()
+
     def test_sorted_export(self):
         study = G(Study, name=STUDY_NAME)
         participant1 = G(Participant, study=study, subject_id="1")
@@ -184,6 +342,103 @@ class TestSDTMExporter:
         assert (data.values[1] == row_two).all()
         assert (data.values[2] == row_one).all()
 
+        # Sorting by a value shared by every row leaves the order to the
+        # other keys
+        exporter.sort_by = [Variables.STUDY_NAME.oid, *exporter.sort_by]
+        exporter.sort_order = ["desc", "asc", "desc"]
+        data = exporter.export()
+
+        assert (data.values[0] == row_three).all()
+        assert (data.values[1] == row_two).all()
+        assert (data.values[2] == row_one).all()
+
+    def test_orm_sorted_export(self, django_assert_num_queries):
+        study = G(Study, name=STUDY_NAME)
+        participant1 = G(Participant, study=study, subject_id="1")
+        participant2 = G(Participant, study=study, subject_id="2")
+        G(
+            Input,
+            participant=participant2,
+            type=InputType.STRING,
+            value="Maybe",
+            question=G(Question),
+        )
+        G(
+            Input,
+            participant=participant2,
+            type=InputType.STRING,
+            value="No",
+            question=G(Question),
+        )
+        G(
+            Input,
+            participant=participant1,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+
+        row_one = [STUDY_NAME, DOMAIN, "2", "Maybe", "", "0"]
+        row_two = [STUDY_NAME, DOMAIN, "2", "No", "", "0"]
+        row_three = [STUDY_NAME, DOMAIN, "1", "Yes", "", "0"]
+
+        exporter = ExampleSDTMExporter(study)
+        exporter.sort_by_orm_fields = {
+            Variables.SUBJECT_ID.oid: (Participant, "subject_id"),
+            Variables.VALUE.oid: (Input, "value"),
+        }
+        exporter.sort_by = [Variables.SUBJECT_ID.oid, Variables.VALUE.oid]
+        exporter.sort_order = ["desc", "desc"]
+
+        # Ordered participants and inputs are fetched with a query each
+        with django_assert_num_queries(2):
+            data = exporter.export()
+
+        assert (data.values[0] == row_two).all()
+        assert (data.values[1] == row_one).all()
+        assert (data.values[2] == row_three).all()
+
+        # The inputs can't be sorted before the participants are
+        exporter.sort_by = Variables.VALUE.oid
+        exporter.sort_order = "asc"
+        data = exporter.export()
+
+        assert (data.values[0] == row_one).all()
+        assert (data.values[1] == row_two).all()
+        assert (data.values[2] == row_three).all()
+
+        # Participants the caller prefetched on the root are exported as they
+        # were fetched, and left prefetched afterwards
+        participants = Participant.objects.order_by("subject_id")
+        study = Study.objects.prefetch_related(
+            Prefetch("participants", queryset=participants)
+        ).get(pk=study.pk)
+        exporter = ExampleSDTMExporter(study)
+        exporter.sort_by_orm_fields = {
+            Variables.SUBJECT_ID.oid: (Participant, "subject_id"),
+        }
+        exporter.sort_by = Variables.SUBJECT_ID.oid
+        exporter.sort_order = "desc"
+        data = exporter.export()
+
+        assert data[Variables.SUBJECT_ID.oid].tolist() == ["2", "2", "1"]
+        with django_assert_num_queries(0):
+            assert [p.subject_id for p in study.participants.all()] == ["1", "2"]
+
+        # Participants the caller filtered out aren't exported
+        participants = Participant.objects.filter(subject_id="1")
+        study = Study.objects.prefetch_related(
+            Prefetch("participants", queryset=participants)
+        ).get(pk=study.pk)
+        exporter = ExampleSDTMExporter(study)
+        exporter.sort_by_orm_fields = {
+            Variables.SUBJECT_ID.oid: (Participant, "subject_id"),
+        }
+        exporter.sort_by = Variables.SUBJECT_ID.oid
+        data = exporter.export()
+
+        assert data[Variables.SUBJECT_ID.oid].tolist() == ["1"]
+
     def test_annotated_export(self):
         study = G(Study, name=STUDY_NAME)
         participant1 = G(Participant, study=study, subject_id="1")
@@ -223,3 +478,81 @@ class TestSDTMExporter:
         assert (data.values[0] == row_three).all()
         assert (data.values[1] == row_one).all()
         assert (data.values[2] == row_two).all()
+
+        # Groups which aren't sorted together are still numbered in order
+        exporter.sort_by = [AnnotatedVariables.VALUE.oid]
+        exporter.annotators = SequenceAnnotator(
+            group_by=[AnnotatedVariables.SUBJECT_ID.oid]
+        )
+        data = exporter.export()
+
+        assert (data.values[0] == row_one).all()
+        assert (data.values[1] == row_two).all()
+        assert (data.values[2] == row_three).all()
+
+    def test_sequence_missing_keys(self, participant):
+        for value, unit in (("b", None), ("a", None), ("c", G(Unit, unit="x"))):
+            G(
+                Input,
+                participant=participant,
+                type=InputType.STRING,
+                value=value,
+                unit=unit,
+                question=G(Question),
+            )
+
+        # Rows missing their group key are numbered as one group, whether or
+        # not the groups are sorted together
+        exporter = MissingUnitExampleSDTMExporter(participant.study)
+        exporter.sort_by = [AnnotatedVariables.UNIT.oid, AnnotatedVariables.VALUE.oid]
+        exporter.annotators = SequenceAnnotator(group_by=[AnnotatedVariables.UNIT.oid])
+        data = exporter.export()
+
+        assert data[AnnotatedVariables.VALUE.oid].tolist() == ["c", "a", "b"]
+        assert data[AnnotatedVariables.SEQUENCE_NUMBER.oid].tolist() == ["1", "1", "2"]
+
+        exporter.sort_by = [AnnotatedVariables.VALUE.oid]
+        data = exporter.export()
+
+        assert data[AnnotatedVariables.VALUE.oid].tolist() == ["a", "b", "c"]
+        assert data[AnnotatedVariables.SEQUENCE_NUMBER.oid].tolist() == ["1", "2", "1"]
+
+    def test_formatted_export(self, study, participant):
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="Yes",
+            question=G(Question),
+        )
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value="No",
+            question=G(Question),
+        )
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value=None,
+            question=G(Question),
+        )
+
+        exporter = ExampleSDTMExporter(study)
+        exporter.sort_by = Variables.VALUE.oid
+        assert exporter.export()[Variables.VALUE.oid].tolist() == ["No", "Yes", None]
+
+        exporter.format_values = True
+        assert exporter.export()[Variables.VALUE.oid].tolist() == ["", "N", "Y"]
+
+        # Datetimes are exported as a datetime64 column, with None as NaT
+        exporter = DatedExampleSDTMExporter(study)
+        exporter.sort_by = Variables.VALUE.oid
+        exporter.format_values = True
+        assert exporter.export()[Variables.VALUE.oid].tolist() == [
+            "",
+            "",
+            "2020-01-02T03:04:05",
+        ]
@@ -3,14 +3,7 @@ import csv
 from ddf import G
 import pytest
 
-from test_project.test_app.models import (
-    Input,
-    InputType,
-    Participant,
-    Question,
-    Study,
-    Unit,
-)
+from test_project.test_app.models import Input, InputType, Participant, Question
 from test_project.test_app.tests.example_sdtm_exporter import (
     DOMAIN,
     EXPORT_DISCLAIMER_TEXT,
@@ -66,6 +59,14 @@ EXPECTED_SINGLE_ROW_CSV = [
 ]
 
 
+class MissingUnitSDTMExporter(ExampleSDTMExporter):
+    def visit_input(self, input):
+        return {
+            Variables.VALUE.oid: input.value,
+            Variables.UNIT.oid: input.unit.unit if input.unit_id else float("nan"),
+        }
+
+
 @pytest.fixture(scope="session")
 def csv_file(tmp_path_factory):
     return tmp_path_factory.mktemp("data") / "export.csv"
@@ -73,25 +74,8 @@ def csv_file(tmp_path_factory):
 
 @pytest.mark.django_db
 class TestSDTMCSVExporter:
-    def test_export_to_csv(self, csv_file):
-        study = G(Study, name=STUDY_NAME)
-        participant = G(Participant, study=study, subject_id=SUBJECT_ID)
-        input1 = G(
-            Input,
-            participant=participant,
-            type=InputType.STRING,
-            value="Yes",
-            question=G(Question),
-        )
-        G(
-            Input,
-            participant=participant,
-            type=InputType.NUMBER_WITH_UNIT,
-            value="10",
-            unit=G(Unit, unit="kg"),
-            question=G(Question),
-        )
-
+    def test_export_to_csv(self, csv_file, study, two_inputs):
+        input1 = two_inputs[0]
         exporter = ExampleSDTMExporter(study)
 
         with open(csv_file, "w") as f:
@@ -100,8 +84,8 @@ class TestSDTMCSVExporter:
         with open(csv_file) as f:
             reader = list(csv.reader(f))
             assert len(reader) == len(EXPECTED_CSV_CONTENT)
-            assert set(",".join(r) for r in reader) == set(
-                ",".join(r) for r in EXPECTED_CSV_CONTENT
+            assert sorted(map(",".join, reader)) == sorted(
+                map(",".join, EXPECTED_CSV_CONTENT)
             )
 
         with open(csv_file, "w") as f:
@@ -119,3 +103,99 @@ class TestSDTMCSVExporter:
             reader = csv.reader(f)
 
             assert list(reader) == EXPECTED_SINGLE_ROW_CSV
+
+    def test_streamed_export_to_csv(self, csv_file, study, two_inputs):
+        exporter = ExampleSDTMExporter(study)
+
+        # Without sorting rows are streamed straight to the file, which
+        # should give the same output as exporting the whole data frame
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            streamed = list(csv.reader(f))
+
+        exporter.sort_by = Variables.VALUE.oid
+        exporter.sort_order = "desc"
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f)) == streamed == EXPECTED_CSV_CONTENT
+
+        # Writing the rows in chunks doesn't change the output
+        exporter.csv_chunk_size = 1
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f)) == EXPECTED_CSV_CONTENT
+
+    def test_streamed_export_to_csv_in_batches(
+        self, csv_file, study, two_inputs, django_assert_num_queries
+    ):
+        participant2 = G(Participant, study=study, subject_id="test2")
+        G(
+            Input,
+            participant=participant2,
+            type=InputType.STRING,
+            value="No",
+            question=G(Question),
+        )
+        exporter = ExampleSDTMExporter(study)
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            streamed = list(csv.reader(f))
+
+        # Participants are fetched with one query, then each participant's
+        # inputs (and their units) with another
+        exporter = ExampleSDTMExporter(study)
+        exporter.prefetch_batch_size = 1
+        with django_assert_num_queries(3):
+            with open(csv_file, "w") as f:
+                exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f)) == streamed
+        assert streamed[2:] == [
+            *EXPECTED_CSV_CONTENT[2:],
+            [STUDY_NAME, DOMAIN, "test2", "No", "", "0"],
+        ]
+
+    def test_streamed_export_to_csv_missing_values(self, csv_file, study, two_inputs):
+        exporter = MissingUnitSDTMExporter(study)
+
+        # Missing values are blanked whether the rows are streamed or have
+        # already been exported to a data frame
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f)) == EXPECTED_CSV_CONTENT
+
+        exporter.export()
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f)) == EXPECTED_CSV_CONTENT
+
+    def test_export_to_csv_quoting(self, csv_file, study, participant):
+        G(
+            Input,
+            participant=participant,
+            type=InputType.STRING,
+            value='A "quoted", value',
+            question=G(Question),
+        )
+
+        exporter = ExampleSDTMExporter(study)
+        exporter.sort_by = Variables.VALUE.oid
+
+        # Values which need quoting are written by the csv module
+        with open(csv_file, "w") as f:
+            exporter.export_to_csv(f)
+        with open(csv_file) as f:
+            assert list(csv.reader(f))[2] == [
+                STUDY_NAME,
+                DOMAIN,
+                SUBJECT_ID,
+                'A "quoted", value',
+                "",
+                "0",
+            ]
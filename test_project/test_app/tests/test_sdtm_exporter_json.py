@@ -1,21 +1,31 @@
+from datetime import datetime
+import json
+
 from ddf import G
 import pytest
 
-from test_project.test_app.models import (
-    Input,
-    InputType,
-    Participant,
-    Question,
-    Study,
-    Unit,
-)
+from sdtm_export import sdtm_exporter
+from test_project.test_app.models import Study
 from test_project.test_app.tests.example_sdtm_exporter import (
     STUDY_NAME,
-    SUBJECT_ID,
     ExampleSDTMExporter,
+    Variables,
 )
 
 
+class DatedExampleSDTMExporter(ExampleSDTMExporter):
+    def visit_input(self, input):
+        # Mixed with strings, the datetime is kept in an object column
+        value = datetime(2020, 1, 2, 3, 4, 5) if input.value == "Yes" else input.value
+        return {Variables.VALUE.oid: value}
+
+
+@pytest.fixture()
+def study():
+    # The study's id is the Dataset-JSON study OID
+    return G(Study, name=STUDY_NAME, id=333)
+
+
 @pytest.fixture()
 def response():
     return {
@@ -83,26 +93,22 @@ def response():
 
 @pytest.mark.django_db
 class TestSDTMDatasetJSONExporter:
-    def test_export_to_json(self, response):
-        study = G(Study, name=STUDY_NAME, id=333)
-        participant = G(Participant, study=study, subject_id=SUBJECT_ID)
-        G(
-            Input,
-            participant=participant,
-            type=InputType.STRING,
-            value="Yes",
-            question=G(Question),
-        )
-        G(
-            Input,
-            participant=participant,
-            type=InputType.NUMBER_WITH_UNIT,
-            value="10",
-            unit=G(Unit, unit="kg"),
-            question=G(Question),
-        )
-
+    def test_export_to_json(self, response, study, two_inputs):
         exporter = ExampleSDTMExporter(study)
         result = exporter.export_to_json()
 
         assert result == response
+        assert json.loads(exporter.export_to_json_string()) == response
+
+    def test_export_to_json_string_datetimes(self, monkeypatch, study, two_inputs):
+        exporter = DatedExampleSDTMExporter(study)
+
+        # Datetimes are written as strings, and the standard library's output
+        # is the same as orjson's
+        json_string = exporter.export_to_json_string()
+        monkeypatch.setattr(sdtm_exporter, "orjson", None)
+        assert exporter.export_to_json_string() == json_string
+
+        result = json.loads(json_string)
+        item_data = result["clinicalData"]["itemGroupData"]["IG.EXAMPLE"]["itemData"]
+        assert [row[3] for row in item_data] == ["2020-01-02 03:04:05", "10"]